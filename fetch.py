@@ -1,27 +1,47 @@
 #!/usr/bin/env python3
 
+import aiohttp
+import asyncio
+import atexit
+import numpy as np
+import os
 import pandas as pd
-import requests
-import time
 
 from pathlib import Path
 from bs4 import BeautifulSoup
 
+URL = "https://www.smartoneblr.com/WssBBMPComplaintRequestDetails.htm"
+ID_START = 20000000
+ID_END = 21000000
+CONCURRENCY = 64
+BATCH_SIZE = 2000
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.3
+
+FORM_DATA = {
+    "compno": "^", "assMntNo": "^", "alfaNo": "^", "SbassMntNo": "^",
+    "pageNameV": "waterTaxSearch.htm^", "mobnoFlg": "^", "mobNumber": "^",
+    "sessionLangCode": "^", "RefNo": "CSCRefNo^", "deptId": "BBMP^",
+    "searchBy": "refNoDiv^", "mobNum": ""
+}
+
 def load_ids(file_path, data_key=None):
     """Load IDs already fetched, excluding recently Registered complaints that need to be refetched"""
     try:
-        df = pd.read_parquet(file_path)
-        
+        # Project only the needed columns instead of reading the full dataset
+        df = pd.read_parquet(file_path, columns=[data_key, 'Grievance Date', 'Grievance Status'])
+
         # Get the 50,000 most recent grievances
         df['Grievance Date'] = pd.to_datetime(df['Grievance Date'])
         recent_df = df.nlargest(50000, 'Grievance Date')
-        
+
         # Get IDs to exclude (registered complaints in recent set)
-        registered_ids = set(int(str(cid)) for cid in recent_df[
-            recent_df['Grievance Status'] == 'Registered'][data_key].dropna())
-        
+        registered_ids = set(recent_df[
+            recent_df['Grievance Status'] == 'Registered'][data_key]
+            .dropna().astype('int64').to_numpy().tolist())
+
         # Get all other IDs that don't need refetching
-        all_ids = set(int(str(cid)) for cid in df[data_key].dropna())
+        all_ids = set(df[data_key].dropna().astype('int64').to_numpy().tolist())
         final_ids = all_ids - registered_ids
         
         print(f"Loaded {len(final_ids)} IDs from {file_path}")
@@ -43,90 +63,198 @@ def load_failed_ids():
         return set()
 
 def save_failed_ids(failed_ids):
-    """Save failed IDs to the file"""
-    with open('.failed.txt', 'w') as f:
-        for failed_id in failed_ids:
+    """Compact failed IDs to the file, sorted and deduplicated, atomically"""
+    with open('.failed.txt.tmp', 'w') as f:
+        for failed_id in sorted(failed_ids):
             f.write(f"{failed_id}\n")
+    os.replace('.failed.txt.tmp', '.failed.txt')
+
+def find_panel(html_content):
+    """Slice the first <div class="panel"...> block out of the templated response.
+
+    Walks a div depth counter from the panel's opening tag; returns None
+    if no panel is found or the divs don't balance.
+    """
+    start = html_content.find(b'<div class="panel')
+    if start == -1:
+        return None
+
+    depth = 0
+    pos = start
+    while True:
+        open_idx = html_content.find(b'<div', pos)
+        close_idx = html_content.find(b'</div', pos)
+        if close_idx == -1:
+            return None
+
+        if open_idx != -1 and open_idx < close_idx:
+            depth += 1
+            pos = open_idx + 4
+        else:
+            depth -= 1
+            end = html_content.find(b'>', close_idx)
+            if end == -1:
+                return None
+            pos = end + 1
+            if depth == 0:
+                return html_content[start:pos]
 
 def extract_panel_content(html_content):
-    """Extract content from div with class='panel'."""
+    """Extract the div with class='panel' from the raw response bytes."""
+    # Fast path: the server response is templated, so a byte scan
+    # avoids building a parse tree for every fetched page
+    if (panel := find_panel(html_content)) is not None:
+        return panel
+
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = BeautifulSoup(html_content, 'lxml')
         panel_div = soup.find('div', class_='panel')
-        return str(panel_div) if panel_div else None
+        return str(panel_div).encode('utf-8') if panel_div else None
     except Exception as e:
         print(f"Error parsing HTML: {e}")
         return None
 
-def should_skip(complaint_id, existing_ids, failed_ids):
-    """Check if complaint ID should be skipped."""
-    return complaint_id in existing_ids or complaint_id in failed_ids
+def build_skip_mask(existing_ids, failed_ids):
+    """Build a boolean mask over the ID range for O(1) skip checks.
 
-def fetch_complaint_details():
-    """Fetch complaint details for missing complaint IDs"""
-    existing_ids = load_ids("data/citizen-grievances.parquet", "Complaint ID")
-    failed_ids = load_failed_ids()
-    
-    Path("raw").mkdir(exist_ok=True)
-    url = "https://www.smartoneblr.com/WssBBMPComplaintRequestDetails.htm"
-    consecutive_invalid = 0
-    complaint_id = 20000000
-    
-    form_data = {
-        "compno": "^", "assMntNo": "^", "alfaNo": "^", "SbassMntNo": "^",
-        "pageNameV": "waterTaxSearch.htm^", "mobnoFlg": "^", "mobNumber": "^",
-        "sessionLangCode": "^", "RefNo": "CSCRefNo^", "deptId": "BBMP^",
-        "searchBy": "refNoDiv^", "mobNum": ""
-    }
-    
-    while complaint_id < 21000000:
-        if should_skip(complaint_id, existing_ids, failed_ids):
+    One bool per candidate ID is far smaller than the Python sets and
+    lets numpy jump over contiguous skipped stretches in bulk.
+    """
+    skip_mask = np.zeros(ID_END - ID_START, dtype=bool)
+    for ids in (existing_ids, failed_ids):
+        if ids:
+            arr = np.fromiter(ids, dtype=np.int64)
+            arr = arr[(arr >= ID_START) & (arr < ID_END)]
+            skip_mask[arr - ID_START] = True
+    return skip_mask
+
+async def fetch_one(session, semaphore, complaint_id):
+    """Fetch the details page for a single complaint ID, retrying with backoff."""
+    async with semaphore:
+        form_data = dict(FORM_DATA,
+                         complainantNo=f"{complaint_id}^",
+                         applicationNo=f"{complaint_id}^")
+        params = {"_show": "Show", "complainantNo": str(complaint_id)}
+
+        for attempt in range(RETRY_TOTAL + 1):
+            try:
+                async with session.post(URL, params=params, data=form_data) as response:
+                    response.raise_for_status()
+                    return complaint_id, await response.read()
+            except Exception as e:
+                if attempt == RETRY_TOTAL:
+                    print(f"Error {complaint_id}: {e}")
+                    return complaint_id, None
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+def process_batch(batch, results, failed_ids, failed_log, consecutive_invalid):
+    """Apply the sequential invalid/skip logic to a batch of fetched responses.
+
+    Returns (consecutive_invalid, stop) where stop signals 75 consecutive
+    invalid IDs were seen and the run should end.
+    """
+    skip_until = 0
+    previous_id = None
+
+    for complaint_id in batch:
+        # IDs skipped between batch members break an invalid streak
+        if previous_id is not None and complaint_id > previous_id + 1:
             consecutive_invalid = 0
-            complaint_id += 1
+        previous_id = complaint_id
+
+        if complaint_id < skip_until:
             continue
-        
-        try:
-            # Update form data for current ID
-            form_data.update({
-                "complainantNo": f"{complaint_id}^",
-                "applicationNo": f"{complaint_id}^"
-            })
-            params = {"_show": "Show", "complainantNo": complaint_id}
-            
-            response = requests.post(url, params=params, data=form_data, timeout=10)
-            response.raise_for_status()
-            
-            if "Grievance Status" in response.text:
-                panel_content = extract_panel_content(response.text)
-                if panel_content:
-                    Path(f"raw/{complaint_id}.html").write_text(panel_content, encoding='utf-8')
-                    print(f"Saved: {complaint_id}")
-                    consecutive_invalid = 0
-                    save_failed_ids(failed_ids)
-                else:
-                    print(f"No panel: {complaint_id}")
-                    consecutive_invalid += 1
-                    failed_ids.add(complaint_id)
+
+        response_body = results.get(complaint_id)
+        if response_body is None:
+            continue
+
+        if b"Grievance Status" in response_body:
+            panel_content = extract_panel_content(response_body)
+            if panel_content:
+                Path(f"raw/{complaint_id}.html").write_bytes(panel_content)
+                print(f"Saved: {complaint_id}")
+                consecutive_invalid = 0
             else:
-                print(f"Invalid: {complaint_id}")
+                print(f"No panel: {complaint_id}")
                 consecutive_invalid += 1
                 failed_ids.add(complaint_id)
+                failed_log.write(f"{complaint_id}\n")
+        else:
+            print(f"Invalid: {complaint_id}")
+            consecutive_invalid += 1
+            failed_ids.add(complaint_id)
+            failed_log.write(f"{complaint_id}\n")
 
-                # Exit after 75 consecutive invalid
-                if consecutive_invalid >= 75:
-                    break
-                
-                # Skip to next hundred after 50 consecutive invalid
-                if consecutive_invalid >= 50:
-                    complaint_id = ((complaint_id // 100) + 1) * 100
-                    print(f"Skipping to {complaint_id}")
-                    continue
-            
-        except Exception as e:
-            print(f"Error {complaint_id}: {e}")
-        
-        time.sleep(0.1)
-        complaint_id += 1
+            # Exit after 75 consecutive invalid
+            if consecutive_invalid >= 75:
+                return consecutive_invalid, True
+
+            # Skip to next hundred after 50 consecutive invalid
+            if consecutive_invalid >= 50:
+                skip_until = ((complaint_id // 100) + 1) * 100
+                print(f"Skipping to {skip_until}")
+
+    return consecutive_invalid, False
+
+async def fetch_complaint_details():
+    """Fetch complaint details for missing complaint IDs"""
+    existing_ids = load_ids("data/citizen-grievances.parquet", "Complaint ID")
+    failed_ids = load_failed_ids()
+
+    Path("raw").mkdir(exist_ok=True)
+    skip_mask = build_skip_mask(existing_ids, failed_ids)
+    consecutive_invalid = 0
+    complaint_id = ID_START
+
+    # Append new failures to a log as they happen; the file is compacted
+    # (sorted + deduplicated) once on exit instead of rewritten per batch
+    initial_failed = len(failed_ids)
+    failed_log = open('.failed.txt', 'a')
+
+    def compact_failed_ids():
+        failed_log.close()
+        if len(failed_ids) != initial_failed:
+            save_failed_ids(failed_ids)
+
+    atexit.register(compact_failed_ids)
+
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=10)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        while complaint_id < ID_END:
+            # Build the next batch of IDs that still need fetching
+            batch = []
+            while complaint_id < ID_END and len(batch) < BATCH_SIZE:
+                offset = complaint_id - ID_START
+                if skip_mask[offset]:
+                    # Jump past the contiguous skipped stretch in one step
+                    offset += int(np.argmin(skip_mask[offset:]))
+                    if skip_mask[offset]:
+                        complaint_id = ID_END
+                        break
+                    complaint_id = ID_START + offset
+
+                batch.append(complaint_id)
+                complaint_id += 1
+
+            if not batch:
+                continue
+
+            tasks = [asyncio.ensure_future(fetch_one(session, semaphore, cid))
+                     for cid in batch]
+            results = {}
+            for future in asyncio.as_completed(tasks):
+                cid, response_text = await future
+                results[cid] = response_text
+
+            consecutive_invalid, stop = process_batch(
+                batch, results, failed_ids, failed_log, consecutive_invalid)
+            failed_log.flush()
+            if stop:
+                break
 
 if __name__ == "__main__":
-    fetch_complaint_details() 
+    asyncio.run(fetch_complaint_details())